@@ -0,0 +1,124 @@
+'''
+Business: Cold-start benchmark for the backend functions - import, first connection and first response time per handler
+Usage: DATABASE_URL=postgresql://... python bench_cold_start.py [--runs 30] [--functions auth,messages] [--modes 0,1] [--event JSON]
+
+Every run starts a fresh interpreter in the function directory, imports index.py
+and serves one request, which is what a cold-started instance does. The requests
+in READ_ONLY_EVENTS create and change no rows (get_chats only refreshes user 1's
+last_seen), so the benchmark can run against a real database; --event replaces
+the request for every selected function. --modes sets DB_PREWARM for the
+child: 0 connects on the first request, 1 opens the connection during init.
+import_ms leaves out connections opened while importing, so it measures the
+imports alone in both modes. Prewarming only moves the connect from the first
+request into init; cold_start_ms is the end-to-end figure to compare.
+'''
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = r'''
+import sys, time
+started = time.perf_counter()
+import psycopg2
+connects = []
+psycopg2_connect = psycopg2.connect
+def timed_connect(*args, **kwargs):
+    connect_started = time.perf_counter()
+    try:
+        return psycopg2_connect(*args, **kwargs)
+    finally:
+        connects.append((time.perf_counter() - connect_started) * 1000)
+psycopg2.connect = timed_connect
+import index
+imported = time.perf_counter()
+import_connects_ms = sum(connects)
+import json
+event = json.loads(sys.argv[1])
+request_started = time.perf_counter()
+try:
+    status = index.handler(event, None)['statusCode']
+except Exception as error:
+    status = type(error).__name__
+finished = time.perf_counter()
+print(json.dumps({
+    'status': status,
+    'import_ms': (imported - started) * 1000 - import_connects_ms,
+    'first_connection_ms': connects[0] if connects else None,
+    'first_response_ms': (finished - request_started) * 1000,
+    'cold_start_ms': (finished - started) * 1000
+}))
+'''
+
+METRICS = ('import_ms', 'first_connection_ms', 'first_response_ms', 'cold_start_ms', 'process_ms')
+
+READ_ONLY_EVENTS = {
+    'auth': {'action': 'login', 'username': 'bench_cold_start', 'password': 'not-a-password'},
+    'profile': {'action': 'get_profile', 'user_id': 1},
+    'messages': {'action': 'get_chats', 'user_id': 1},
+    'recovery': {'action': 'reset_password', 'username': 'bench_cold_start', 'code': '000000', 'new_password': 'unused'}
+}
+
+def read_only_event(name: str) -> Dict[str, Any]:
+    if name not in READ_ONLY_EVENTS:
+        raise SystemExit(f'no read-only event for {name}, pass one with --event')
+    return {'httpMethod': 'POST', 'queryStringParameters': {}, 'headers': {}, 'body': json.dumps(READ_ONLY_EVENTS[name])}
+
+def run_once(function_dir: str, event: Dict[str, Any], prewarm: str) -> Dict[str, Any]:
+    env = dict(os.environ, DB_PREWARM=prewarm, PYTHONDONTWRITEBYTECODE='1')
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, json.dumps(event)],
+        cwd=function_dir, env=env, capture_output=True, text=True
+    )
+    process_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['process_ms'] = process_ms
+    return sample
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+def main(argv: List[str]) -> int:
+    with open(os.path.join(BACKEND_DIR, 'func2url.json')) as func2url_file:
+        deployed = list(json.load(func2url_file))
+
+    parser = argparse.ArgumentParser(description='Measure cold starts of backend functions')
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--functions', default=','.join(deployed))
+    parser.add_argument('--modes', default='0,1')
+    parser.add_argument('--event', type=json.loads, help='event JSON to send instead of the read-only default')
+    args = parser.parse_args(argv)
+
+    if not os.environ.get('DATABASE_URL'):
+        print('DATABASE_URL is required, first connection and first response need a database', file=sys.stderr)
+        return 2
+
+    print(f"{'function':<12}{'prewarm':>8}{'status':>18}" + ''.join(f'{metric + " p50/p99":>30}' for metric in METRICS))
+    for name in args.functions.split(','):
+        function_dir = os.path.join(BACKEND_DIR, name)
+        event = args.event or read_only_event(name)
+        for prewarm in args.modes.split(','):
+            samples = [run_once(function_dir, event, prewarm) for _ in range(args.runs)]
+            statuses = sorted({str(sample['status']) for sample in samples})
+            row = f"{name:<12}{prewarm:>8}{'/'.join(statuses):>18}"
+            for metric in METRICS:
+                values = [sample[metric] for sample in samples if sample[metric] is not None]
+                cell = f'{percentile(values, 50):.1f}/{percentile(values, 99):.1f}' if values else '-'
+                row += f'{cell:>30}'
+            print(row)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,290 @@
+'''
+Business: Maintenance - purge expired/used recovery codes in small batches, reconcile stale presence flags and the per-user chat index
+Args: event - dict with httpMethod, headers (X-Maintenance-Token), body (optional batch_size, max_batches)
+      context - object with request_id attribute
+Returns: HTTP response with rows processed and time spent per task
+
+Nothing in this repo schedules the function: configure a timer/cron on the hosting
+platform that POSTs here with the MAINTENANCE_TOKEN value in X-Maintenance-Token.
+The chat index task only looks at conversations with messages from the last
+CHAT_INDEX_WINDOW_MINUTES, so the timer must fire more often than that; older
+drift needs rebalance.py reindex.
+'''
+
+import json
+import os
+import hmac
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+from typing import Dict, Any, List
+
+from sharding import get_shard_dsns, home_shard, get_shard_cursor
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_BATCHES = 50
+MAX_BATCH_SIZE = 1000
+MAX_BATCHES = 200
+# last_seen is refreshed by login and every messages request (history, send, get_chats); clients
+# that stay idle longer than this without calling messages are marked offline.
+PRESENCE_TIMEOUT_MINUTES = int(os.environ.get('PRESENCE_TIMEOUT_MINUTES', '15'))
+CHAT_INDEX_WINDOW_MINUTES = int(os.environ.get('CHAT_INDEX_WINDOW_MINUTES', '60'))
+# Conversations with a message newer than this are left to the send path's own upsert.
+CHAT_INDEX_SETTLE_SECONDS = 60
+# Same epoch as next_message_id(): message ids carry milliseconds since it above 12 bits of shard and sequence.
+MESSAGE_ID_EPOCH_MS = 1704067200000
+
+PREWARM_MAX_AGE = 60
+PREWARM_CONNECT_TIMEOUT = 5
+prewarmed: Dict[str, Any] = {}
+
+def get_db_connection():
+    conn = prewarmed.pop('conn', None)
+    if conn is not None:
+        if not conn.closed and time.monotonic() - prewarmed['opened_at'] < PREWARM_MAX_AGE:
+            return conn
+        conn.close()
+    dsn = os.environ.get('DATABASE_URL')
+    return psycopg2.connect(dsn)
+
+def prewarm_db_connection():
+    if os.environ.get('DB_PREWARM', '0') != '1' or not os.environ.get('DATABASE_URL'):
+        return
+    try:
+        prewarmed['conn'] = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=PREWARM_CONNECT_TIMEOUT)
+        prewarmed['opened_at'] = time.monotonic()
+    except psycopg2.Error:
+        pass
+
+prewarm_db_connection()
+
+def run_in_batches(conn, cur, query: str, params: tuple, batch_size: int, max_batches: int) -> int:
+    total = 0
+    for _ in range(max_batches):
+        cur.execute(query, params)
+        affected = cur.rowcount
+        conn.commit()
+        total += affected
+        if affected < batch_size:
+            break
+    return total
+
+def purge_recovery_codes(conn, cur, batch_size: int, max_batches: int) -> int:
+    return run_in_batches(conn, cur, """
+        DELETE FROM recovery_codes
+        WHERE id IN (
+            SELECT id FROM recovery_codes
+            WHERE used = true OR expires_at < CURRENT_TIMESTAMP
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (batch_size,), batch_size, max_batches)
+
+def reconcile_presence(conn, cur, batch_size: int, max_batches: int) -> int:
+    return run_in_batches(conn, cur, """
+        UPDATE users SET online = false
+        WHERE id IN (
+            SELECT id FROM users
+            WHERE online = true
+              AND last_seen < CURRENT_TIMESTAMP - make_interval(mins => %s)
+              AND username <> 'maxogram_support'
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (PRESENCE_TIMEOUT_MINUTES, batch_size), batch_size, max_batches)
+
+def message_id_floor(seconds_ago: float) -> int:
+    return int((time.time() - seconds_ago) * 1000 - MESSAGE_ID_EPOCH_MS) << 12
+
+def recent_conversations(cur, window_start: int, after: tuple, batch_size: int) -> List[Dict[str, Any]]:
+    cur.execute("""
+        SELECT DISTINCT LEAST(sender_id, receiver_id) AS low_id,
+                        GREATEST(sender_id, receiver_id) AS high_id
+        FROM messages
+        WHERE id >= %s
+          AND (LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id)) > (%s, %s)
+        ORDER BY low_id, high_id
+        LIMIT %s
+    """, (window_start, after[0], after[1], batch_size))
+    return cur.fetchall()
+
+def chat_index_entries(cur, conversations: List[Dict[str, Any]], settled_before: int) -> List[Dict[str, Any]]:
+    cur.execute("""
+        SELECT * FROM (
+            SELECT DISTINCT ON (p.user_id, p.other_user_id)
+                   p.user_id, p.other_user_id, m.id AS last_message_id,
+                   m.message_text AS last_message, m.is_voice AS last_message_is_voice,
+                   m.created_at AS last_message_time,
+                   (SELECT COUNT(*) FROM messages u
+                    WHERE LEAST(u.sender_id, u.receiver_id) = c.low_id
+                      AND GREATEST(u.sender_id, u.receiver_id) = c.high_id
+                      AND u.sender_id = p.other_user_id
+                      AND u.read_at IS NULL) AS unread_count
+            FROM messages m
+            JOIN unnest(%s::int[], %s::int[]) AS c(low_id, high_id)
+              ON LEAST(m.sender_id, m.receiver_id) = c.low_id
+             AND GREATEST(m.sender_id, m.receiver_id) = c.high_id
+            CROSS JOIN LATERAL (
+                VALUES (m.sender_id, m.receiver_id), (m.receiver_id, m.sender_id)
+            ) AS p(user_id, other_user_id)
+            ORDER BY p.user_id, p.other_user_id, m.id DESC
+        ) latest
+        WHERE last_message_id < %s
+    """, ([row['low_id'] for row in conversations], [row['high_id'] for row in conversations], settled_before))
+    return cur.fetchall()
+
+def upsert_chat_index(cur, entries: List[Dict[str, Any]]) -> int:
+    execute_values(cur, """
+        INSERT INTO user_chats (user_id, other_user_id, last_message_id, last_message,
+                                last_message_is_voice, last_message_time, unread_count)
+        VALUES %s
+        ON CONFLICT (user_id, other_user_id) DO UPDATE SET
+            last_message_id = EXCLUDED.last_message_id,
+            last_message = EXCLUDED.last_message,
+            last_message_is_voice = EXCLUDED.last_message_is_voice,
+            last_message_time = EXCLUDED.last_message_time,
+            unread_count = EXCLUDED.unread_count
+        WHERE EXCLUDED.last_message_id >= user_chats.last_message_id
+          AND (user_chats.last_message_id, user_chats.last_message, user_chats.last_message_is_voice,
+               user_chats.last_message_time, user_chats.unread_count)
+              IS DISTINCT FROM
+              (EXCLUDED.last_message_id, EXCLUDED.last_message, EXCLUDED.last_message_is_voice,
+               EXCLUDED.last_message_time, EXCLUDED.unread_count)
+    """, [(row['user_id'], row['other_user_id'], row['last_message_id'], row['last_message'],
+           row['last_message_is_voice'], row['last_message_time'], row['unread_count']) for row in entries],
+       page_size=len(entries))
+    return cur.rowcount
+
+def reconcile_chat_index(conn, cur, batch_size: int, max_batches: int) -> int:
+    dsns = get_shard_dsns()
+    shard_connections: Dict[int, Any] = {
+        shard: (conn, cur) for shard, dsn in enumerate(dsns) if dsn == os.environ.get('DATABASE_URL')
+    }
+    window_start = message_id_floor(CHAT_INDEX_WINDOW_MINUTES * 60)
+    settled_before = message_id_floor(CHAT_INDEX_SETTLE_SECONDS)
+    total = 0
+    batches = 0
+
+    try:
+        for shard in range(len(dsns)):
+            shard_conn, shard_cur = get_shard_cursor(dsns, shard_connections, shard)
+            after = (-1, -1)
+            while batches < max_batches:
+                batches += 1
+                conversations = recent_conversations(shard_cur, window_start, after, batch_size)
+                entries = chat_index_entries(shard_cur, conversations, settled_before) if conversations else []
+                shard_conn.commit()
+
+                by_home: Dict[int, List[Dict[str, Any]]] = {}
+                for entry in entries:
+                    by_home.setdefault(home_shard(entry['user_id'], len(dsns)), []).append(entry)
+                for home, home_entries in by_home.items():
+                    index_conn, index_cur = get_shard_cursor(dsns, shard_connections, home)
+                    total += upsert_chat_index(index_cur, home_entries)
+                    index_conn.commit()
+
+                if len(conversations) < batch_size:
+                    break
+                after = (conversations[-1]['low_id'], conversations[-1]['high_id'])
+
+    finally:
+        for shard_conn, shard_cur in shard_connections.values():
+            if shard_conn is not conn:
+                shard_cur.close()
+                shard_conn.close()
+
+    return total
+
+def is_authorized(event: Dict[str, Any]) -> bool:
+    expected = os.environ.get('MAINTENANCE_TOKEN', '')
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    provided = headers.get('x-maintenance-token', '')
+    return bool(expected) and hmac.compare_digest(provided.encode(), expected.encode())
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Maintenance-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    if not is_authorized(event):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещен'}),
+            'isBase64Encoded': False
+        }
+
+    body_data = json.loads(event.get('body') or '{}')
+    try:
+        batch_size = int(body_data.get('batch_size', DEFAULT_BATCH_SIZE))
+        max_batches = int(body_data.get('max_batches', DEFAULT_MAX_BATCHES))
+    except (TypeError, ValueError):
+        batch_size = max_batches = 0
+
+    if batch_size < 1 or max_batches < 1:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'batch_size и max_batches должны быть положительными числами'}),
+            'isBase64Encoded': False
+        }
+
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    max_batches = min(max_batches, MAX_BATCHES)
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        started = time.monotonic()
+
+        task_started = time.monotonic()
+        codes_deleted = purge_recovery_codes(conn, cur, batch_size, max_batches)
+        codes_ms = round((time.monotonic() - task_started) * 1000, 1)
+
+        task_started = time.monotonic()
+        users_offline = reconcile_presence(conn, cur, batch_size, max_batches)
+        presence_ms = round((time.monotonic() - task_started) * 1000, 1)
+
+        task_started = time.monotonic()
+        chats_fixed = reconcile_chat_index(conn, cur, batch_size, max_batches)
+        chats_ms = round((time.monotonic() - task_started) * 1000, 1)
+
+        report = {
+            'recovery_codes': {'rows': codes_deleted, 'duration_ms': codes_ms},
+            'presence': {'rows': users_offline, 'duration_ms': presence_ms},
+            'chat_index': {'rows': chats_fixed, 'duration_ms': chats_ms},
+            'rows_processed': codes_deleted + users_offline + chats_fixed,
+            'duration_ms': round((time.monotonic() - started) * 1000, 1)
+        }
+        print(json.dumps({'maintenance': report}))
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(report),
+            'isBase64Encoded': False
+        }
+
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,79 @@
+'''
+Business: Benchmark for the voice pipeline - bytes saved per message and transcoding throughput per core
+Usage: python bench_voice.py [--seconds 15] [--messages 32] [--source-bitrate 128000]
+
+Builds a synthetic MediaRecorder-style recording (webm/Opus at the browser's
+default bitrate), then pushes it through transcode_voice from a thread pool,
+once per worker count up to os.cpu_count(). voice_worker.py transcodes one
+message at a time per process; the pool here shows how far running several
+workers side by side scales.
+'''
+
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+import av
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from voice import SAMPLE_RATE, transcode_voice
+
+def synthesize_recording(seconds: float, bitrate: int) -> bytes:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    signal = envelope * (0.4 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.random.default_rng(0).standard_normal(t.size))
+    pcm = np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+
+    out = io.BytesIO()
+    with av.open(out, 'w', format='webm') as container:
+        stream = container.add_stream('libopus', rate=SAMPLE_RATE, layout='mono')
+        stream.bit_rate = bitrate
+        for start in range(0, pcm.size, 960):
+            frame = av.AudioFrame.from_ndarray(pcm[start:start + 960].reshape(1, -1), format='s16', layout='mono')
+            frame.sample_rate = SAMPLE_RATE
+            frame.pts = start
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+def run(workers: int, recording: bytes, messages: int) -> float:
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(transcode_voice, [recording] * workers))
+        started = time.monotonic()
+        list(pool.map(transcode_voice, [recording] * messages))
+        return time.monotonic() - started
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark voice transcoding')
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--messages', type=int, default=32)
+    parser.add_argument('--source-bitrate', type=int, default=128000)
+    args = parser.parse_args(argv)
+
+    recording = synthesize_recording(args.seconds, args.source_bitrate)
+    result = transcode_voice(recording)
+    original_url_bytes = len(f"data:audio/webm;base64,{base64.b64encode(recording).decode()}")
+    stored_url_bytes = len(result['voice_url'])
+
+    print(f"source: {args.seconds:.0f}s, {len(recording)} bytes raw, {original_url_bytes} bytes as data URL")
+    print(f"stored: {result['encoded_bytes']} bytes raw, {stored_url_bytes} bytes as data URL, "
+          f"duration {result['duration']}s")
+    print(f"bytes saved per message: {original_url_bytes - stored_url_bytes} "
+          f"({(1 - stored_url_bytes / original_url_bytes) * 100:.1f}%)")
+    print(f"single message: {result['transcode_ms']} ms wall, {result['cpu_ms']} ms cpu")
+
+    print('workers  audio_s/s  audio_s/s/core  messages/s')
+    for workers in range(1, (os.cpu_count() or 1) + 1):
+        elapsed = run(workers, recording, args.messages)
+        audio_rate = args.messages * args.seconds / elapsed
+        print(f"{workers:7d}  {audio_rate:9.1f}  {audio_rate / workers:14.1f}  {args.messages / elapsed:10.1f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
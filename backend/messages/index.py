@@ -1,20 +1,61 @@
 '''
-Business: Send, receive and store messages (text and voice) between users
+Business: Send, receive and store messages (text and voice) between users, sharded by conversation
 Args: event - dict with httpMethod, body (sender_id, receiver_id, message_text, voice_url)
       context - object with request_id, function_name attributes
 Returns: HTTP response with messages list or confirmation
+
+Voice messages are stored as recorded with voice_pending = true and re-encoded
+off the request path by voice_worker.py; until then they play from the original
+recording.
 '''
 
+import base64
+import binascii
 import json
 import os
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
 
+from sharding import get_shard_dsns, conversation_shard, home_shard, get_shard_cursor, insert_message, update_chat_index
+
+MAX_VOICE_BYTES = 10 * 1024 * 1024
+# Base64 grows the payload by 4/3; the rest covers the data: URL header.
+MAX_VOICE_URL_CHARS = MAX_VOICE_BYTES * 4 // 3 + 256
+
+PREWARM_MAX_AGE = 60
+PREWARM_CONNECT_TIMEOUT = 5
+prewarmed: Dict[str, Any] = {}
+
 def get_db_connection():
+    conn = prewarmed.pop('conn', None)
+    if conn is not None:
+        if not conn.closed and time.monotonic() - prewarmed['opened_at'] < PREWARM_MAX_AGE:
+            return conn
+        conn.close()
     dsn = os.environ.get('DATABASE_URL')
     return psycopg2.connect(dsn)
 
+def prewarm_db_connection():
+    if os.environ.get('DB_PREWARM', '0') != '1' or not os.environ.get('DATABASE_URL'):
+        return
+    try:
+        prewarmed['conn'] = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=PREWARM_CONNECT_TIMEOUT)
+        prewarmed['opened_at'] = time.monotonic()
+    except psycopg2.Error:
+        pass
+
+prewarm_db_connection()
+
+def is_valid_voice_payload(voice_url: str) -> bool:
+    payload = voice_url.split(',', 1)[1] if voice_url.startswith('data:') else voice_url
+    try:
+        base64.b64decode(payload, validate=True)
+    except binascii.Error:
+        return False
+    return True
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -33,6 +74,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
+    dsns = get_shard_dsns()
+    shard_connections: Dict[int, Any] = {
+        shard: (conn, cur) for shard, dsn in enumerate(dsns) if dsn == os.environ.get('DATABASE_URL')
+    }
     
     try:
         if method == 'GET':
@@ -48,24 +93,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            cur.execute("""
-                SELECT m.id, m.sender_id, m.receiver_id, m.message_text, m.voice_url, 
-                       m.voice_duration, m.is_voice, m.created_at, m.read_at,
-                       u.username as sender_name, u.avatar_initials as sender_avatar
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE (m.sender_id = %s AND m.receiver_id = %s) 
-                   OR (m.sender_id = %s AND m.receiver_id = %s)
-                ORDER BY m.created_at ASC
-            """, (user_id, other_user_id, other_user_id, user_id))
+            low_id, high_id = sorted((int(user_id), int(other_user_id)))
+            shard_conn, shard_cur = get_shard_cursor(dsns, shard_connections, conversation_shard(low_id, high_id, len(dsns)))
+            shard_cur.execute("""
+                SELECT id, sender_id, receiver_id, message_text, voice_url,
+                       voice_duration, voice_waveform, is_voice, voice_pending, created_at, read_at
+                FROM messages
+                WHERE LEAST(sender_id, receiver_id) = %s
+                  AND GREATEST(sender_id, receiver_id) = %s
+                ORDER BY id ASC
+            """, (low_id, high_id))
+            history = shard_cur.fetchall()
+            
+            cur.execute("SELECT id, username, avatar_initials FROM users WHERE id IN (%s, %s)", (user_id, other_user_id))
+            senders = {row['id']: row for row in cur.fetchall()}
             
-            messages = cur.fetchall()
+            messages = []
+            for msg in history:
+                sender = senders.get(msg['sender_id'])
+                if not sender:
+                    continue
+                messages.append(dict(msg, sender_name=sender['username'], sender_avatar=sender['avatar_initials']))
+            
+            cur.execute("UPDATE users SET online = true, last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user_id,))
+            conn.commit()
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
-                    'messages': [dict(msg) for msg in messages]
+                    'messages': messages
                 }, default=str),
                 'isBase64Encoded': False
             }
@@ -98,15 +155,59 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("""
-                    INSERT INTO messages (sender_id, receiver_id, message_text, voice_url, voice_duration, is_voice)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id, sender_id, receiver_id, message_text, voice_url, voice_duration, is_voice, created_at
-                """, (sender_id, receiver_id, message_text if message_text else None, voice_url, voice_duration, is_voice))
+                voice_pending = False
+                if voice_url:
+                    if not isinstance(voice_url, str):
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Некорректные данные голосового сообщения'}),
+                            'isBase64Encoded': False
+                        }
+                    
+                    if len(voice_url) > MAX_VOICE_URL_CHARS:
+                        return {
+                            'statusCode': 413,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Голосовое сообщение слишком большое'}),
+                            'isBase64Encoded': False
+                        }
+                    
+                    if not is_valid_voice_payload(voice_url):
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Некорректные данные голосового сообщения'}),
+                            'isBase64Encoded': False
+                        }
+                    
+                    voice_pending = True
+                    is_voice = True
                 
-                message = cur.fetchone()
+                cur.execute("UPDATE users SET online = true, last_seen = CURRENT_TIMESTAMP WHERE id = %s", (sender_id,))
                 conn.commit()
                 
+                shard = conversation_shard(sender_id, receiver_id, len(dsns))
+                shard_conn, shard_cur = get_shard_cursor(dsns, shard_connections, shard)
+                message = insert_message(shard_conn, shard_cur, shard, {
+                    'sender_id': sender_id,
+                    'receiver_id': receiver_id,
+                    'message_text': message_text if message_text else None,
+                    'voice_url': voice_url,
+                    'voice_duration': voice_duration,
+                    'is_voice': is_voice,
+                    'voice_pending': voice_pending
+                }, 'id, sender_id, receiver_id, message_text, voice_url, voice_duration, voice_waveform, is_voice, voice_pending, created_at')
+                
+                for owner_id, other_id, unread_delta in ((sender_id, receiver_id, 0), (receiver_id, sender_id, 1)):
+                    index_conn, index_cur = get_shard_cursor(dsns, shard_connections, home_shard(owner_id, len(dsns)))
+                    try:
+                        update_chat_index(index_cur, owner_id, other_id, message, unread_delta)
+                        index_conn.commit()
+                    except psycopg2.Error as error:
+                        index_conn.rollback()
+                        print(json.dumps({'chat_index_error': str(error), 'user_id': owner_id, 'message_id': message['id']}))
+                
                 return {
                     'statusCode': 201,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -128,48 +229,48 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("""
-                    WITH last_messages AS (
-                        SELECT DISTINCT ON (
-                            CASE 
-                                WHEN sender_id = %s THEN receiver_id 
-                                ELSE sender_id 
-                            END
-                        )
-                        CASE 
-                            WHEN sender_id = %s THEN receiver_id 
-                            ELSE sender_id 
-                        END as other_user_id,
-                        message_text,
-                        is_voice,
-                        created_at
-                        FROM messages
-                        WHERE sender_id = %s OR receiver_id = %s
-                        ORDER BY 
-                            CASE 
-                                WHEN sender_id = %s THEN receiver_id 
-                                ELSE sender_id 
-                            END,
-                            created_at DESC
+                index_conn, index_cur = get_shard_cursor(dsns, shard_connections, home_shard(user_id, len(dsns)))
+                index_cur.execute("""
+                    SELECT other_user_id, last_message, last_message_is_voice,
+                           last_message_time, unread_count
+                    FROM user_chats
+                    WHERE user_id = %s
+                    ORDER BY last_message_time DESC
+                """, (user_id,))
+                index_rows = index_cur.fetchall()
+                
+                users = {}
+                if index_rows:
+                    cur.execute(
+                        "SELECT id, username, avatar_initials, online FROM users WHERE id = ANY(%s)",
+                        ([row['other_user_id'] for row in index_rows],)
                     )
-                    SELECT u.id, u.username, u.avatar_initials, u.online,
-                           lm.message_text as last_message,
-                           lm.is_voice as last_message_is_voice,
-                           lm.created_at as last_message_time,
-                           (SELECT COUNT(*) FROM messages 
-                            WHERE sender_id = u.id AND receiver_id = %s AND read_at IS NULL) as unread_count
-                    FROM users u
-                    JOIN last_messages lm ON u.id = lm.other_user_id
-                    ORDER BY lm.created_at DESC
-                """, (user_id, user_id, user_id, user_id, user_id, user_id))
+                    users = {row['id']: row for row in cur.fetchall()}
                 
-                chats = cur.fetchall()
+                chats = []
+                for row in index_rows:
+                    user = users.get(row['other_user_id'])
+                    if not user:
+                        continue
+                    chats.append({
+                        'id': user['id'],
+                        'username': user['username'],
+                        'avatar_initials': user['avatar_initials'],
+                        'online': user['online'],
+                        'last_message': row['last_message'],
+                        'last_message_is_voice': row['last_message_is_voice'],
+                        'last_message_time': row['last_message_time'],
+                        'unread_count': row['unread_count']
+                    })
+                
+                cur.execute("UPDATE users SET online = true, last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user_id,))
+                conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({
-                        'chats': [dict(chat) for chat in chats]
+                        'chats': chats
                     }, default=str),
                     'isBase64Encoded': False
                 }
@@ -191,5 +292,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     finally:
+        for shard_conn, shard_cur in shard_connections.values():
+            if shard_conn is not conn:
+                shard_cur.close()
+                shard_conn.close()
         cur.close()
         conn.close()
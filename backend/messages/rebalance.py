@@ -0,0 +1,232 @@
+'''
+Business: Operator tool for the messages shards - create shard schema, copy conversations after the shard list changes, clean up the old copies, rebuild the per-user chat index
+Usage: python rebalance.py init DSN [DSN ...]
+       python rebalance.py copy --from DSN,DSN --to DSN,DSN,DSN [--batch-size 500] [--dry-run]
+       python rebalance.py cleanup --from DSN,DSN --to DSN,DSN,DSN [--batch-size 500]
+       python rebalance.py reindex --shards DSN,DSN,DSN
+
+Shards are addressed by their position in MESSAGES_SHARD_URLS. Routing uses jump
+consistent hashing, so appending a shard to the end of the list only moves the
+conversations that now belong to the new shard. To grow from N to N+1 shards:
+  1. init the new shard;
+  2. copy --from OLD --to NEW while traffic still routes by OLD (source rows stay);
+  3. switch MESSAGES_SHARD_URLS to NEW;
+  4. copy --from OLD --to NEW again to pick up messages written before the switch;
+  5. cleanup --from OLD --to NEW, which copies anything still missing and only then
+     deletes the moved rows from their old shard;
+  6. reindex --shards NEW.
+Copy and cleanup are idempotent and can be rerun. Reindex upserts and only replaces
+an entry when the snapshot is at least as new, so it is safe with live writes.
+
+Local check with several Postgres instances:
+    docker run -d -p 5433:5432 -e POSTGRES_PASSWORD=pg postgres:16
+    docker run -d -p 5434:5432 -e POSTGRES_PASSWORD=pg postgres:16
+    python rebalance.py init postgresql://postgres:pg@localhost:5433/postgres postgresql://postgres:pg@localhost:5434/postgres
+'''
+
+import argparse
+import os
+import sys
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+from typing import Dict, Any, List, Tuple
+
+from sharding import check_shard_count, conversation_shard, home_shard
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shard_schema.sql')
+
+MESSAGE_COLUMNS = ('id', 'sender_id', 'receiver_id', 'message_text', 'voice_url',
+                   'voice_duration', 'voice_waveform', 'is_voice', 'voice_pending', 'created_at', 'read_at')
+
+def parse_dsns(value: str) -> List[str]:
+    try:
+        return check_shard_count([dsn.strip() for dsn in value.split(',') if dsn.strip()])
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+def init_shards(dsns: List[str]):
+    with open(SCHEMA_PATH) as schema_file:
+        schema = schema_file.read()
+    for dsn in dsns:
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(schema)
+            conn.commit()
+        finally:
+            conn.close()
+        print(f'initialized {dsn}')
+
+def list_conversations(cur) -> List[Tuple[int, int]]:
+    cur.execute("""
+        SELECT DISTINCT LEAST(sender_id, receiver_id) AS low_id,
+                        GREATEST(sender_id, receiver_id) AS high_id
+        FROM messages
+    """)
+    return [(row['low_id'], row['high_id']) for row in cur.fetchall()]
+
+def copy_conversation(source_conn, target_conn, low_id: int, high_id: int, batch_size: int, delete: bool) -> int:
+    processed = 0
+    last_id = -1
+    with source_conn.cursor(cursor_factory=RealDictCursor) as source_cur, target_conn.cursor() as target_cur:
+        while True:
+            source_cur.execute(f"""
+                SELECT {', '.join(MESSAGE_COLUMNS)}
+                FROM messages
+                WHERE LEAST(sender_id, receiver_id) = %s
+                  AND GREATEST(sender_id, receiver_id) = %s
+                  AND id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (low_id, high_id, last_id, batch_size))
+            rows = source_cur.fetchall()
+            if not rows:
+                break
+
+            execute_values(
+                target_cur,
+                f"INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}) VALUES %s ON CONFLICT (id) DO NOTHING",
+                [tuple(row[column] for column in MESSAGE_COLUMNS) for row in rows]
+            )
+            target_conn.commit()
+
+            ids = [row['id'] for row in rows]
+            if delete:
+                target_cur.execute("SELECT id FROM messages WHERE id = ANY(%s)", (ids,))
+                present = [row[0] for row in target_cur.fetchall()]
+                target_conn.commit()
+                source_cur.execute("DELETE FROM messages WHERE id = ANY(%s)", (present,))
+                source_conn.commit()
+
+            processed += len(rows)
+            last_id = ids[-1]
+    return processed
+
+def rebalance_shards(old_dsns: List[str], new_dsns: List[str], batch_size: int, delete: bool, dry_run: bool):
+    target_conns: Dict[str, Any] = {}
+    try:
+        for source_dsn in old_dsns:
+            source_conn = psycopg2.connect(source_dsn)
+            try:
+                with source_conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    conversations = list_conversations(cur)
+                source_conn.commit()
+
+                moved_conversations = 0
+                moved_messages = 0
+                for low_id, high_id in conversations:
+                    target_dsn = new_dsns[conversation_shard(low_id, high_id, len(new_dsns))]
+                    if target_dsn == source_dsn:
+                        continue
+                    moved_conversations += 1
+                    if dry_run:
+                        continue
+                    if target_dsn not in target_conns:
+                        target_conns[target_dsn] = psycopg2.connect(target_dsn)
+                    moved_messages += copy_conversation(
+                        source_conn, target_conns[target_dsn], low_id, high_id, batch_size, delete
+                    )
+            finally:
+                source_conn.close()
+
+            action = 'checked and removed from source' if delete else 'processed (existing rows skipped)'
+            print(f'{source_dsn}: {moved_conversations} of {len(conversations)} conversations, '
+                  f'{moved_messages} messages {action}' + (' (dry run)' if dry_run else ''))
+    finally:
+        for conn in target_conns.values():
+            conn.close()
+
+def collect_chat_index(dsns: List[str]) -> Dict[Tuple[int, int], Dict[str, Any]]:
+    entries: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for dsn in dsns:
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT DISTINCT ON (p.user_id, p.other_user_id)
+                           p.user_id, p.other_user_id, m.id AS last_message_id,
+                           m.message_text AS last_message, m.is_voice AS last_message_is_voice,
+                           m.created_at AS last_message_time,
+                           (SELECT COUNT(*) FROM messages u
+                            WHERE u.sender_id = p.other_user_id AND u.receiver_id = p.user_id
+                              AND u.read_at IS NULL) AS unread_count
+                    FROM messages m
+                    CROSS JOIN LATERAL (
+                        VALUES (m.sender_id, m.receiver_id), (m.receiver_id, m.sender_id)
+                    ) AS p(user_id, other_user_id)
+                    ORDER BY p.user_id, p.other_user_id, m.id DESC
+                """)
+                for row in cur.fetchall():
+                    key = (row['user_id'], row['other_user_id'])
+                    if key not in entries or entries[key]['last_message_id'] < row['last_message_id']:
+                        entries[key] = dict(row)
+        finally:
+            conn.close()
+    return entries
+
+def reindex_shards(dsns: List[str]):
+    entries = collect_chat_index(dsns)
+    by_shard: Dict[int, List[Dict[str, Any]]] = {shard: [] for shard in range(len(dsns))}
+    for (user_id, _), entry in entries.items():
+        by_shard[home_shard(user_id, len(dsns))].append(entry)
+
+    for shard, rows in by_shard.items():
+        conn = psycopg2.connect(dsns[shard])
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT DISTINCT user_id FROM user_chats")
+                foreign = [row[0] for row in cur.fetchall() if home_shard(row[0], len(dsns)) != shard]
+                cur.execute("DELETE FROM user_chats WHERE user_id = ANY(%s)", (foreign,))
+                execute_values(cur, """
+                    INSERT INTO user_chats (user_id, other_user_id, last_message_id, last_message,
+                                            last_message_is_voice, last_message_time, unread_count)
+                    VALUES %s
+                    ON CONFLICT (user_id, other_user_id) DO UPDATE SET
+                        last_message_id = GREATEST(user_chats.last_message_id, EXCLUDED.last_message_id),
+                        last_message = CASE WHEN EXCLUDED.last_message_id >= user_chats.last_message_id
+                                            THEN EXCLUDED.last_message ELSE user_chats.last_message END,
+                        last_message_is_voice = CASE WHEN EXCLUDED.last_message_id >= user_chats.last_message_id
+                                                     THEN EXCLUDED.last_message_is_voice ELSE user_chats.last_message_is_voice END,
+                        last_message_time = CASE WHEN EXCLUDED.last_message_id >= user_chats.last_message_id
+                                                 THEN EXCLUDED.last_message_time ELSE user_chats.last_message_time END,
+                        unread_count = CASE WHEN EXCLUDED.last_message_id >= user_chats.last_message_id
+                                            THEN EXCLUDED.unread_count ELSE user_chats.unread_count END
+                """, [(row['user_id'], row['other_user_id'], row['last_message_id'], row['last_message'],
+                       row['last_message_is_voice'], row['last_message_time'], row['unread_count']) for row in rows])
+            conn.commit()
+        finally:
+            conn.close()
+        print(f'{dsns[shard]}: {len(rows)} chat index rows upserted, {len(foreign)} users with a new home removed')
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Manage messages shards')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init_parser = commands.add_parser('init', help='create shard schema')
+    init_parser.add_argument('dsns', nargs='+')
+
+    copy_parser = commands.add_parser('copy', help='copy conversations to their shard in the new layout, keep the source rows')
+    cleanup_parser = commands.add_parser('cleanup', help='copy what is still missing, then delete moved rows from the old shard')
+    for phase_parser in (copy_parser, cleanup_parser):
+        phase_parser.add_argument('--from', dest='old_dsns', type=parse_dsns, required=True)
+        phase_parser.add_argument('--to', dest='new_dsns', type=parse_dsns, required=True)
+        phase_parser.add_argument('--batch-size', type=int, default=500)
+    copy_parser.add_argument('--dry-run', action='store_true')
+
+    reindex_parser = commands.add_parser('reindex', help='rebuild user_chats on every home shard')
+    reindex_parser.add_argument('--shards', dest='dsns', type=parse_dsns, required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'init':
+        init_shards(args.dsns)
+    elif args.command == 'copy':
+        rebalance_shards(args.old_dsns, args.new_dsns, args.batch_size, delete=False, dry_run=args.dry_run)
+    elif args.command == 'cleanup':
+        rebalance_shards(args.old_dsns, args.new_dsns, args.batch_size, delete=True, dry_run=False)
+    elif args.command == 'reindex':
+        reindex_shards(args.dsns)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,48 @@
+CREATE SEQUENCE IF NOT EXISTS message_id_seq;
+
+CREATE OR REPLACE FUNCTION next_message_id(shard_id INTEGER) RETURNS BIGINT AS $$
+DECLARE
+    epoch_ms BIGINT := 1704067200000;
+    now_ms BIGINT;
+    seq BIGINT;
+BEGIN
+    seq := nextval('message_id_seq') % 128;
+    now_ms := FLOOR(EXTRACT(EPOCH FROM clock_timestamp()) * 1000);
+    RETURN ((now_ms - epoch_ms) << 12) | ((shard_id % 32) << 7) | seq;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TABLE IF NOT EXISTS messages (
+    id BIGINT PRIMARY KEY,
+    sender_id INTEGER NOT NULL,
+    receiver_id INTEGER NOT NULL,
+    message_text TEXT,
+    voice_url TEXT,
+    voice_duration INTEGER,
+    voice_waveform TEXT,
+    is_voice BOOLEAN DEFAULT false,
+    voice_pending BOOLEAN DEFAULT false,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    read_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_conversation
+ON messages (LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), id);
+
+CREATE INDEX IF NOT EXISTS idx_messages_voice_pending
+ON messages (id)
+WHERE voice_pending = true;
+
+CREATE TABLE IF NOT EXISTS user_chats (
+    user_id INTEGER NOT NULL,
+    other_user_id INTEGER NOT NULL,
+    last_message_id BIGINT NOT NULL,
+    last_message TEXT,
+    last_message_is_voice BOOLEAN DEFAULT false,
+    last_message_time TIMESTAMP,
+    unread_count INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, other_user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_chats_recent
+ON user_chats (user_id, last_message_time DESC);
@@ -0,0 +1,97 @@
+'''
+Business: Voice message pipeline - decode the client recording, re-encode it to low-bitrate Opus, measure real duration and build a waveform preview
+Args: raw audio bytes in any container/codec FFmpeg can read (MediaRecorder webm/ogg/mp4)
+Returns: dict with encoded data URL, duration, waveform and byte counts
+'''
+
+import base64
+import io
+import os
+import time
+import av
+import numpy as np
+from typing import Dict, Any, List, Tuple
+
+SAMPLE_RATE = 48000
+OPUS_BITRATE = int(os.environ.get('VOICE_OPUS_BITRATE', '24000'))
+MAX_VOICE_SECONDS = int(os.environ.get('VOICE_MAX_SECONDS', '300'))
+WAVEFORM_BARS = 64
+WAVEFORM_LEVELS = 31
+OUTPUT_FORMAT = 'webm'
+OUTPUT_MIME = 'audio/webm;codecs=opus'
+
+class VoiceDecodeError(Exception):
+    pass
+
+class VoiceTooLongError(VoiceDecodeError):
+    pass
+
+def decode_voice_payload(voice_url: str) -> bytes:
+    payload = voice_url.split(',', 1)[1] if voice_url.startswith('data:') else voice_url
+    try:
+        return base64.b64decode(payload, validate=True)
+    except ValueError as error:
+        raise VoiceDecodeError('voice_url is not valid base64') from error
+
+def build_waveform(frame_peaks: List[Tuple[int, int]], total_samples: int) -> List[int]:
+    bars = [0] * WAVEFORM_BARS
+    position = 0
+    for samples, peak in frame_peaks:
+        bar = min(WAVEFORM_BARS - 1, (position + samples // 2) * WAVEFORM_BARS // total_samples)
+        bars[bar] = max(bars[bar], peak)
+        position += samples
+    loudest = max(bars)
+    if loudest == 0:
+        return bars
+    return [int(round(peak / loudest * WAVEFORM_LEVELS)) for peak in bars]
+
+def transcode_voice(raw: bytes) -> Dict[str, Any]:
+    started = time.monotonic()
+    cpu_started = time.thread_time()
+    frame_peaks: List[Tuple[int, int]] = []
+    total_samples = 0
+    max_samples = MAX_VOICE_SECONDS * SAMPLE_RATE
+    encoded = io.BytesIO()
+
+    try:
+        with av.open(io.BytesIO(raw)) as source, av.open(encoded, 'w', format=OUTPUT_FORMAT) as target:
+            if not source.streams.audio:
+                raise VoiceDecodeError('no audio stream in voice payload')
+            resampler = av.AudioResampler(format='s16', layout='mono', rate=SAMPLE_RATE)
+            opus = target.add_stream('libopus', rate=SAMPLE_RATE, layout='mono')
+            opus.bit_rate = OPUS_BITRATE
+
+            def encode(frames):
+                nonlocal total_samples
+                for frame in frames:
+                    total_samples += frame.samples
+                    if total_samples > max_samples:
+                        raise VoiceTooLongError(f'voice message is longer than {MAX_VOICE_SECONDS}s')
+                    pcm = frame.to_ndarray()
+                    frame_peaks.append((frame.samples, int(np.abs(pcm.astype(np.int32)).max()) if pcm.size else 0))
+                    for packet in opus.encode(frame):
+                        target.mux(packet)
+
+            for frame in source.decode(source.streams.audio[0]):
+                encode(resampler.resample(frame))
+            encode(resampler.resample(None))
+            for packet in opus.encode(None):
+                target.mux(packet)
+    except VoiceDecodeError:
+        raise
+    except Exception as error:
+        raise VoiceDecodeError(f'{type(error).__name__}: {error}') from error
+
+    if total_samples == 0:
+        raise VoiceDecodeError('voice payload contains no audio')
+
+    data = encoded.getvalue()
+    return {
+        'voice_url': f"data:{OUTPUT_MIME};base64,{base64.b64encode(data).decode()}",
+        'duration': max(1, round(total_samples / SAMPLE_RATE)),
+        'waveform': base64.b64encode(bytes(build_waveform(frame_peaks, total_samples))).decode(),
+        'source_bytes': len(raw),
+        'encoded_bytes': len(data),
+        'transcode_ms': round((time.monotonic() - started) * 1000, 1),
+        'cpu_ms': round((time.thread_time() - cpu_started) * 1000, 1)
+    }
@@ -0,0 +1,92 @@
+'''
+Business: Voice worker - re-encode voice messages that the send path stored as recorded, on every messages shard
+Usage: python voice_worker.py [--once] [--interval 5]
+
+The send path inserts voice messages with the client's recording and
+voice_pending = true, then returns. This worker claims one pending message at a
+time with FOR UPDATE SKIP LOCKED, transcodes it and replaces voice_url,
+voice_duration and voice_waveform. Several workers can run side by side. A
+recording that cannot be decoded keeps its original payload and is only
+unflagged. Reads MESSAGES_SHARD_URLS and DATABASE_URL like the handler.
+'''
+
+import argparse
+import json
+import sys
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional
+
+from sharding import get_shard_dsns
+from voice import VoiceDecodeError, decode_voice_payload, transcode_voice
+
+def transcode_next(conn) -> Optional[Dict[str, Any]]:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, voice_url FROM messages
+            WHERE voice_pending = true
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        row = cur.fetchone()
+        if row is None:
+            conn.commit()
+            return None
+
+        try:
+            transcoded = transcode_voice(decode_voice_payload(row['voice_url']))
+        except VoiceDecodeError as error:
+            cur.execute("UPDATE messages SET voice_pending = false WHERE id = %s", (row['id'],))
+            conn.commit()
+            return {'id': row['id'], 'error': str(error)}
+
+        cur.execute("""
+            UPDATE messages
+            SET voice_url = %s, voice_duration = %s, voice_waveform = %s, voice_pending = false
+            WHERE id = %s
+        """, (transcoded['voice_url'], transcoded['duration'], transcoded['waveform'], row['id']))
+        conn.commit()
+
+    return {
+        'id': row['id'],
+        'original_bytes': len(row['voice_url']),
+        'stored_bytes': len(transcoded['voice_url']),
+        'bytes_saved': len(row['voice_url']) - len(transcoded['voice_url']),
+        'duration': transcoded['duration'],
+        'transcode_ms': transcoded['transcode_ms'],
+        'cpu_ms': transcoded['cpu_ms']
+    }
+
+def drain(dsns: List[str]) -> int:
+    processed = 0
+    for dsn in dsns:
+        conn = psycopg2.connect(dsn)
+        try:
+            while True:
+                stats = transcode_next(conn)
+                if stats is None:
+                    break
+                print(json.dumps({'voice_transcode': stats}))
+                processed += 1
+        finally:
+            conn.close()
+    return processed
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Transcode pending voice messages')
+    parser.add_argument('--once', action='store_true', help='exit after one pass over the shards')
+    parser.add_argument('--interval', type=float, default=5, help='seconds to wait after a pass with nothing pending')
+    args = parser.parse_args(argv)
+
+    dsns = get_shard_dsns()
+    while True:
+        processed = drain(dsns)
+        if args.once:
+            return 0
+        if processed == 0:
+            time.sleep(args.interval)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
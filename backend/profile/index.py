@@ -7,18 +7,41 @@ Returns: HTTP response with updated user data or error
 
 import json
 import os
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
 from datetime import datetime, timedelta
 import re
 
+USERNAME_RE = re.compile(r'^[a-zA-Z0-9_]{3,20}$')
+
+PREWARM_MAX_AGE = 60
+PREWARM_CONNECT_TIMEOUT = 5
+prewarmed: Dict[str, Any] = {}
+
 def get_db_connection():
+    conn = prewarmed.pop('conn', None)
+    if conn is not None:
+        if not conn.closed and time.monotonic() - prewarmed['opened_at'] < PREWARM_MAX_AGE:
+            return conn
+        conn.close()
     dsn = os.environ.get('DATABASE_URL')
     return psycopg2.connect(dsn)
 
+def prewarm_db_connection():
+    if os.environ.get('DB_PREWARM', '0') != '1' or not os.environ.get('DATABASE_URL'):
+        return
+    try:
+        prewarmed['conn'] = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=PREWARM_CONNECT_TIMEOUT)
+        prewarmed['opened_at'] = time.monotonic()
+    except psycopg2.Error:
+        pass
+
+prewarm_db_connection()
+
 def validate_username(username: str) -> bool:
-    return bool(re.match(r'^[a-zA-Z0-9_]{3,20}$', username))
+    return bool(USERNAME_RE.match(username))
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
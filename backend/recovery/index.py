@@ -7,23 +7,76 @@ Returns: HTTP response with code sent confirmation or password reset success
 
 import json
 import os
+import time
 import psycopg2
 import hashlib
 import random
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
-from datetime import datetime, timedelta
+
+from sharding import get_shard_dsns, conversation_shard, home_shard, get_shard_cursor, insert_message, update_chat_index
+
+PREWARM_MAX_AGE = 60
+PREWARM_CONNECT_TIMEOUT = 5
+prewarmed: Dict[str, Any] = {}
 
 def get_db_connection():
+    conn = prewarmed.pop('conn', None)
+    if conn is not None:
+        if not conn.closed and time.monotonic() - prewarmed['opened_at'] < PREWARM_MAX_AGE:
+            return conn
+        conn.close()
     dsn = os.environ.get('DATABASE_URL')
     return psycopg2.connect(dsn)
 
+def prewarm_db_connection():
+    if os.environ.get('DB_PREWARM', '0') != '1' or not os.environ.get('DATABASE_URL'):
+        return
+    try:
+        prewarmed['conn'] = psycopg2.connect(os.environ['DATABASE_URL'], connect_timeout=PREWARM_CONNECT_TIMEOUT)
+        prewarmed['opened_at'] = time.monotonic()
+    except psycopg2.Error:
+        pass
+
+prewarm_db_connection()
+
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 def generate_code() -> str:
     return ''.join([str(random.randint(0, 9)) for _ in range(6)])
 
+def send_support_message(conn, cur, support_id: int, user_id: int, text: str):
+    dsns = get_shard_dsns()
+    shard_connections: Dict[int, Any] = {
+        shard: (conn, cur) for shard, dsn in enumerate(dsns) if dsn == os.environ.get('DATABASE_URL')
+    }
+    
+    try:
+        shard = conversation_shard(support_id, user_id, len(dsns))
+        shard_conn, shard_cur = get_shard_cursor(dsns, shard_connections, shard)
+        message = insert_message(shard_conn, shard_cur, shard, {
+            'sender_id': support_id,
+            'receiver_id': user_id,
+            'message_text': text,
+            'is_voice': False
+        }, 'id, message_text, is_voice, created_at')
+        
+        for owner_id, other_id, unread_delta in ((support_id, user_id, 0), (user_id, support_id, 1)):
+            index_conn, index_cur = get_shard_cursor(dsns, shard_connections, home_shard(owner_id, len(dsns)))
+            try:
+                update_chat_index(index_cur, owner_id, other_id, message, unread_delta)
+                index_conn.commit()
+            except psycopg2.Error as error:
+                index_conn.rollback()
+                print(json.dumps({'chat_index_error': str(error), 'user_id': owner_id, 'message_id': message['id']}))
+    
+    finally:
+        for shard_conn, shard_cur in shard_connections.values():
+            if shard_conn is not conn:
+                shard_cur.close()
+                shard_conn.close()
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -90,11 +143,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             if support:
                 message = f"Код восстановления для @{user['username']}: {code}\n\nКод действителен 15 минут."
-                cur.execute(
-                    "INSERT INTO messages (sender_id, receiver_id, message_text, is_voice) VALUES (%s, %s, %s, false)",
-                    (support['id'], user['id'], message)
-                )
-                conn.commit()
+                send_support_message(conn, cur, support['id'], user['id'], message)
             
             return {
                 'statusCode': 200,
@@ -0,0 +1,92 @@
+'''
+Business: Shard routing for direct messages - pick the shard of a conversation and the home shard of a user's chat index
+Args: user ids and the shard list from MESSAGES_SHARD_URLS
+Returns: shard positions, shard cursors, message inserts and the user_chats upsert
+
+Importing this module opens no connections, so operator tools can use it. Each
+function deploys only its own directory, so messages/, recovery/ and maintenance/
+carry copies of this file that must stay identical, otherwise messages and chat
+index rows land on a shard the messages function never reads.
+'''
+
+import hashlib
+import os
+import psycopg2
+from psycopg2.errors import UniqueViolation
+from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List
+
+# next_message_id() packs the shard into 5 bits and a per-millisecond sequence into 7 bits.
+MAX_SHARDS = 32
+MESSAGE_ID_ATTEMPTS = 3
+
+def check_shard_count(dsns: List[str]) -> List[str]:
+    if len(dsns) > MAX_SHARDS:
+        raise ValueError(f'{len(dsns)} message shards configured, message ids have room for {MAX_SHARDS}')
+    return dsns
+
+def get_shard_dsns() -> List[str]:
+    shard_urls = os.environ.get('MESSAGES_SHARD_URLS', '')
+    dsns = [dsn.strip() for dsn in shard_urls.split(',') if dsn.strip()]
+    return check_shard_count(dsns) or [os.environ.get('DATABASE_URL')]
+
+def jump_hash(key: int, buckets: int) -> int:
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+def shard_for_key(key: str, buckets: int) -> int:
+    digest = hashlib.md5(key.encode()).digest()
+    return jump_hash(int.from_bytes(digest[:8], 'big'), buckets)
+
+def conversation_shard(user_a: Any, user_b: Any, buckets: int) -> int:
+    low, high = sorted((int(user_a), int(user_b)))
+    return shard_for_key(f'conversation:{low}:{high}', buckets)
+
+def home_shard(user_id: Any, buckets: int) -> int:
+    return shard_for_key(f'user:{int(user_id)}', buckets)
+
+def get_shard_cursor(dsns: List[str], connections: Dict[int, Any], shard: int):
+    if shard not in connections:
+        conn = psycopg2.connect(dsns[shard])
+        connections[shard] = (conn, conn.cursor(cursor_factory=RealDictCursor))
+    return connections[shard]
+
+def insert_message(conn, cur, shard: int, values: Dict[str, Any], returning: str) -> Dict[str, Any]:
+    # More than 128 inserts in one millisecond on a shard, or the clock stepping back, can repeat an
+    # id; the next attempt draws a new sequence value.
+    columns = ', '.join(values)
+    placeholders = ', '.join(['%s'] * len(values))
+    for attempt in range(MESSAGE_ID_ATTEMPTS):
+        try:
+            cur.execute(
+                f"INSERT INTO messages (id, {columns}) VALUES (next_message_id(%s), {placeholders}) RETURNING {returning}",
+                (shard, *values.values())
+            )
+            message = cur.fetchone()
+            conn.commit()
+            return message
+        except UniqueViolation:
+            conn.rollback()
+            if attempt == MESSAGE_ID_ATTEMPTS - 1:
+                raise
+
+def update_chat_index(cur, user_id: Any, other_user_id: Any, message: Dict[str, Any], unread_delta: int):
+    cur.execute("""
+        INSERT INTO user_chats (user_id, other_user_id, last_message_id, last_message,
+                                last_message_is_voice, last_message_time, unread_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, other_user_id) DO UPDATE SET
+            last_message_id = GREATEST(user_chats.last_message_id, EXCLUDED.last_message_id),
+            last_message = CASE WHEN EXCLUDED.last_message_id > user_chats.last_message_id
+                                THEN EXCLUDED.last_message ELSE user_chats.last_message END,
+            last_message_is_voice = CASE WHEN EXCLUDED.last_message_id > user_chats.last_message_id
+                                         THEN EXCLUDED.last_message_is_voice ELSE user_chats.last_message_is_voice END,
+            last_message_time = CASE WHEN EXCLUDED.last_message_id > user_chats.last_message_id
+                                     THEN EXCLUDED.last_message_time ELSE user_chats.last_message_time END,
+            unread_count = user_chats.unread_count + EXCLUDED.unread_count
+    """, (user_id, other_user_id, message['id'], message['message_text'],
+          message['is_voice'], message['created_at'], unread_delta))
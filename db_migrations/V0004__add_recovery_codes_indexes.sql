@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS idx_recovery_codes_active
+ON t_p80059633_maxogram_messenger.recovery_codes (user_id, code, expires_at)
+WHERE used = false;
@@ -0,0 +1,47 @@
+CREATE SEQUENCE IF NOT EXISTS t_p80059633_maxogram_messenger.message_id_seq;
+
+CREATE OR REPLACE FUNCTION t_p80059633_maxogram_messenger.next_message_id(shard_id INTEGER) RETURNS BIGINT AS $$
+DECLARE
+    epoch_ms BIGINT := 1704067200000;
+    now_ms BIGINT;
+    seq BIGINT;
+BEGIN
+    seq := nextval('t_p80059633_maxogram_messenger.message_id_seq') % 128;
+    now_ms := FLOOR(EXTRACT(EPOCH FROM clock_timestamp()) * 1000);
+    RETURN ((now_ms - epoch_ms) << 12) | ((shard_id % 32) << 7) | seq;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE t_p80059633_maxogram_messenger.messages
+ALTER COLUMN id TYPE BIGINT,
+ALTER COLUMN id DROP DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_messages_conversation
+ON t_p80059633_maxogram_messenger.messages (LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), id);
+
+CREATE TABLE IF NOT EXISTS t_p80059633_maxogram_messenger.user_chats (
+    user_id INTEGER NOT NULL,
+    other_user_id INTEGER NOT NULL,
+    last_message_id BIGINT NOT NULL,
+    last_message TEXT,
+    last_message_is_voice BOOLEAN DEFAULT false,
+    last_message_time TIMESTAMP,
+    unread_count INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, other_user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_chats_recent
+ON t_p80059633_maxogram_messenger.user_chats (user_id, last_message_time DESC);
+
+INSERT INTO t_p80059633_maxogram_messenger.user_chats
+    (user_id, other_user_id, last_message_id, last_message, last_message_is_voice, last_message_time, unread_count)
+SELECT DISTINCT ON (p.user_id, p.other_user_id)
+       p.user_id, p.other_user_id, m.id, m.message_text, m.is_voice, m.created_at,
+       (SELECT COUNT(*) FROM t_p80059633_maxogram_messenger.messages u
+        WHERE u.sender_id = p.other_user_id AND u.receiver_id = p.user_id AND u.read_at IS NULL)
+FROM t_p80059633_maxogram_messenger.messages m
+CROSS JOIN LATERAL (
+    VALUES (m.sender_id, m.receiver_id), (m.receiver_id, m.sender_id)
+) AS p(user_id, other_user_id)
+ORDER BY p.user_id, p.other_user_id, m.created_at DESC, m.id DESC
+ON CONFLICT (user_id, other_user_id) DO NOTHING;
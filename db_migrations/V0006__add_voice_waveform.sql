@@ -0,0 +1,2 @@
+ALTER TABLE t_p80059633_maxogram_messenger.messages
+ADD COLUMN IF NOT EXISTS voice_waveform TEXT;
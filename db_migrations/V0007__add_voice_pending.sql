@@ -0,0 +1,6 @@
+ALTER TABLE t_p80059633_maxogram_messenger.messages
+ADD COLUMN IF NOT EXISTS voice_pending BOOLEAN DEFAULT false;
+
+CREATE INDEX IF NOT EXISTS idx_messages_voice_pending
+ON t_p80059633_maxogram_messenger.messages (id)
+WHERE voice_pending = true;